@@ -5,8 +5,54 @@ Uses YOLO pose keypoints to classify exercises and count repetitions based on bo
 Supports multiple people simultaneously with automatic exercise detection.
 """
 
+import logging
+
+import numpy as np
+import torch
+
 from ultralytics.solutions.solutions import BaseSolution, SolutionAnnotator, SolutionResults
 
+from fast_kernels import (
+    PUSHUP,
+    SQUAT,
+    STAGE_DOWN,
+    STAGE_UNSET,
+    STAGE_UP,
+    UNKNOWN,
+    USED_KPTS,
+    detect_and_angle,
+    update_stage,
+    warmup,
+)
+
+# Human-readable names for the integer exercise codes used by the kernels
+_EXERCISE_NAMES = {SQUAT: "squat", PUSHUP: "pushup"}
+
+# Display names for the integer stage codes used by the kernels
+_STAGE_NAMES = {STAGE_UP: "up", STAGE_DOWN: "down", STAGE_UNSET: "-"}
+
+logger = logging.getLogger(__name__)
+
+# Per-person tracking state packed into one contiguous record per person
+_STATE_DTYPE = np.dtype([
+    ("squat", "i4"),    # squat repetition count
+    ("pushup", "i4"),   # push-up repetition count
+    ("angle", "f4"),    # current joint angle
+    ("stage", "i1"),    # STAGE_UP / STAGE_DOWN / STAGE_UNSET
+    ("exercise", "i1"), # SQUAT / PUSHUP / UNKNOWN
+])
+
+# Count field incremented for each exercise code
+_COUNT_FIELDS = {SQUAT: "squat", PUSHUP: "pushup"}
+
+# Keypoint indices used to compute/draw the joint angle, built once at import.
+# Squat uses the right leg: hip (12), knee (14), ankle (16).
+# Push-up uses the right arm: shoulder (6), elbow (8), wrist (10).
+_SQUAT_IDX = [12, 14, 16]
+_PUSHUP_IDX = [6, 8, 10]
+_IDX = {"squat": _SQUAT_IDX, "pushup": _PUSHUP_IDX}
+
+
 class AIGym_Modified(BaseSolution):
     """
     Extended solution class for recognizing and counting squats and push-ups in a video stream.
@@ -16,105 +62,84 @@ class AIGym_Modified(BaseSolution):
     ('up' and 'down') and counts repetitions per person, supporting multiple people doing different exercises.
 
     Attributes:
-        squat_count (List[int]): Squat repetition counts for each tracked person.
-        pushup_count (List[int]): Push-up repetition counts for each tracked person.
-        angle (List[float]): Current joint angle used to determine exercise stage.
-        stage (List[str]): Current stage of exercise for each person ('up', 'down', or '-').
-        exercise (List[str | None]): Currently detected exercise type ('squat' or 'pushup') per person.
+        state (np.ndarray): Structured array (_STATE_DTYPE) holding per-person squat and
+            push-up counts, current joint angle, stage code and exercise code in one
+            contiguous record per person.
         up_angle (float): Angle threshold representing the "up" position.
         down_angle (float): Angle threshold representing the "down" position.
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, verbose=False, draw=True, **kwargs):
         """
         Initializes the AIGym_Modified class with custom thresholds and data tracking lists.
 
         Args:
+            verbose (bool): If True, log per-person exercise and count updates at DEBUG level.
+            draw (bool): If False, skip all frame annotation and return the raw frame;
+                useful when only the counts are consumed (e.g. headless server mode).
             **kwargs (Any): Configuration options passed to BaseSolution.
         """
         super().__init__(**kwargs)
-        self.squat_count = []
-        self.pushup_count = []
-        self.angle = []
-        self.stage = []
-        self.exercise = []
+        self.verbose = verbose
+        self.draw = draw
+
+        # Per-person state as one preallocated structured array, grown geometrically on demand
+        self.state = self._new_state(8)
 
         # Load angle thresholds from the configuration
         self.up_angle = float(self.CFG.get("up_angle", 160))
         self.down_angle = float(self.CFG.get("down_angle", 90))
 
-    def detect_exercise(self, kpts):
-        """
-        Automatically classify the exercise as 'squat' or 'pushup' based on keypoint geometry.
+        # Annotator is built lazily on the first frame and reused afterwards
+        self._annotator = None
 
-        Args:
-            kpts (List[List[float]]): Keypoints for a person (x, y, confidence).
+        # Index tensor for the on-device keypoint gather, built once on the
+        # model's device; process() only re-homes it if the keypoints ever
+        # arrive from a different device
+        self._used_idx_t = torch.as_tensor(USED_KPTS, device=getattr(self.model, "device", "cpu"))
 
-        Returns:
-            str | None: Returns 'squat', 'pushup', or None if classification fails.
-        """
-        try:
-            # Calculate average Y-coordinates of shoulders and hips
-            shoulder_y = (kpts[5][1] + kpts[6][1]) / 2
-            hip_y = (kpts[11][1] + kpts[12][1]) / 2
-            
-            # Compare vertical and horizontal distance between shoulders and hips
-            delta_y = abs(shoulder_y - hip_y)
-            delta_x = abs((kpts[5][0] + kpts[6][0]) / 2 - (kpts[11][0] + kpts[12][0]) / 2)
-            
-            # If vertical distance is greater, assume upright posture -> squat
-            return "squat" if delta_x < delta_y else "pushup"
-        except:
-            return None
-
-    def get_kpts_indices(self, exercise):
-        """
-        Return the three keypoint indices required to compute the joint angle for the given exercise.
-
-        Args:
-            exercise (str): Either 'squat' or 'pushup'.
+        # Trigger Numba JIT compilation now so the first frame is not stalled
+        warmup()
 
-        Returns:
-            List[int]: List of keypoint indices for angle estimation.
-        """
-        # Use right leg for squat: hip (12), knee (14), ankle (16)
-        # Use right arm for push-up: shoulder (6), elbow (8), wrist (10)
-        return [12, 14, 16] if exercise == "squat" else [6, 8, 10]
+    @staticmethod
+    def _new_state(cap):
+        """Allocate a zeroed state array of `cap` records with stage/exercise marked unset."""
+        state = np.zeros(cap, dtype=_STATE_DTYPE)
+        state["stage"] = STAGE_UNSET
+        state["exercise"] = UNKNOWN
+        return state
 
-    def initialize_person(self, person_id):
+    def _ensure_capacity(self, n):
         """
-        Initialize tracking data structures for a new person ID if not already present.
+        Make sure the per-person state array can hold at least `n` person IDs.
 
         Args:
-            person_id (int): ID of the tracked person.
+            n (int): Required number of slots (highest person ID + 1).
         """
-        # Ensure lists are large enough to hold data for current person ID
-        while len(self.squat_count) <= person_id:
-            self.squat_count.append(0)
-            self.pushup_count.append(0)
-            self.angle.append(0)
-            self.stage.append("-")
-            self.exercise.append(None)
-
-    def update_stage_and_count(self, person_id, exercise, angle):
+        cap = self.state.shape[0]
+        if n <= cap:
+            return
+
+        # Double the capacity so growth cost is amortized O(1) per new ID
+        new = self._new_state(max(n, 2 * cap))
+        new[:cap] = self.state
+        self.state = new
+
+    def update_stage_and_count(self, person_id, exercise_code, angle):
         """
         Update the stage ('up' or 'down') and count for a given person based on angle thresholds.
 
         Args:
             person_id (int): ID of the tracked person.
-            exercise (str): Exercise type ('squat' or 'pushup').
+            exercise_code (int): Exercise code (SQUAT or PUSHUP).
             angle (float): Estimated joint angle.
         """
-        # Detect transition from "up" to "down" to increment the repetition counter
-        if angle < self.down_angle:
-            if self.stage[person_id] == "up":
-                if exercise == "squat":
-                    self.squat_count[person_id] += 1
-                elif exercise == "pushup":
-                    self.pushup_count[person_id] += 1
-            self.stage[person_id] = "down"
-        elif angle > self.up_angle:
-            self.stage[person_id] = "up"
+        # Branchless transition kernel: a rep is counted on "up" -> "down"
+        new_stage, inc = update_stage(
+            int(self.state["stage"][person_id]), angle, self.up_angle, self.down_angle
+        )
+        self.state["stage"][person_id] = new_stage
+        self.state[_COUNT_FIELDS[exercise_code]][person_id] += inc
 
     def draw_overlay(self, annotator, keypoints, kpts_indices, angle, person_id, exercise):
         """
@@ -134,8 +159,8 @@ class AIGym_Modified(BaseSolution):
         # Overlay real-time info: angle, count, stage, and person ID
         annotator.plot_angle_and_count_and_stage(
             angle_text=angle,
-            count_text=f"Squats:{self.squat_count[person_id]} Push-ups:{self.pushup_count[person_id]}",
-            stage_text=f"{self.stage[person_id]} ({exercise}) [Person-ID {person_id}]",
+            count_text=f"Squats:{self.state['squat'][person_id]} Push-ups:{self.state['pushup'][person_id]}",
+            stage_text=f"{_STAGE_NAMES[int(self.state['stage'][person_id])]} ({exercise}) [Person-ID {person_id}]",
             center_kpt=keypoints[kpts_indices[1]],
         )
 
@@ -150,59 +175,82 @@ class AIGym_Modified(BaseSolution):
         Returns:
             SolutionResults: Object containing processed frame and tracking data.
         """
-        annotator = SolutionAnnotator(im0, line_width=self.line_width)
-        
+        # Reuse one annotator across frames (fonts/line styles are rebuilt by the
+        # constructor); only the working image changes from frame to frame.
+        # With draw=False, annotation is skipped entirely and counts are still updated.
+        if self.draw:
+            if self._annotator is None:
+                self._annotator = SolutionAnnotator(im0, line_width=self.line_width)
+            else:
+                self._annotator.im = im0
+            annotator = self._annotator
+        else:
+            annotator = None
+
         # Extract pose tracking data from the image
         self.extract_tracks(im0)
         tracks = self.tracks[0]
 
         if tracks.boxes.id is not None:
-            for i, track_id in enumerate(tracks.boxes.id.int().tolist()):
-                self.initialize_person(track_id)
-
-                # Extract keypoints for the current person
-                kpts = tracks.keypoints.data[i].cpu().numpy()
-                
-                # Classify the exercise based on body geometry
-                exercise = self.detect_exercise(kpts)
-                if exercise is None:
+            # Gather only the joints the math kernels need while the tensor is
+            # still on-device, then move keypoints and track IDs to the host in
+            # single transfers: [N, 8, 3] over PCIe instead of [N, 17, 3].
+            # The float() cast normalizes FP16 keypoints (half-precision
+            # inference) to float32, which Numba cannot compile for.
+            kpt_data = tracks.keypoints.data
+            if self._used_idx_t.device != kpt_data.device:
+                self._used_idx_t = self._used_idx_t.to(kpt_data.device)
+            all_kpts = kpt_data[:, self._used_idx_t].float().cpu().numpy()
+            ids_np = tracks.boxes.id.cpu().numpy().astype(np.int64)
+
+            # Grow the state arrays once for the highest ID in this frame,
+            # removing the per-person capacity branch from the loop
+            self._ensure_capacity(int(ids_np.max()) + 1)
+
+            for i, track_id in enumerate(ids_np):
+                # Slice the keypoints of the current person from the batched copy
+                kpts = all_kpts[i]
+
+                # Classify the exercise and compute the joint angle in one JIT-compiled pass
+                exercise_code, angle = detect_and_angle(kpts)
+                if exercise_code == UNKNOWN:
                     continue # Skip if exercise can't be identified
-                
+
                 # Save exercise type for this person
-                self.exercise[track_id] = exercise
-                
-                # Get the indices of keypoints used for angle estimation
-                kpts_indices = self.get_kpts_indices(exercise)
-                
-                # Retrieve the three joints as tensors
-                keypoints_cpu = [tracks.keypoints.data[i][idx].cpu() for idx in kpts_indices]
-
-                # Estimate joint angle
-                self.angle[track_id] = annotator.estimate_pose_angle(*keypoints_cpu)
-                
+                exercise = _EXERCISE_NAMES[exercise_code]
+                self.state["exercise"][track_id] = exercise_code
+
+                # Get the indices of keypoints used for angle estimation (drawing only)
+                kpts_indices = _IDX[exercise]
+
+                self.state["angle"][track_id] = angle
+
                 # Update stage and count based on the angle
-                self.update_stage_and_count(track_id, exercise, self.angle[track_id])
-                
+                self.update_stage_and_count(track_id, exercise_code, angle)
+
                 # Draw annotated overlay with info
-                self.draw_overlay(
-                    annotator, tracks.keypoints.data[i], kpts_indices, self.angle[track_id], track_id, exercise
-                )
-
-                # Console debug (this part can be commented): print the exercise and counts per person
-                print(
-                    f"[ID {track_id}] Esercizio: {exercise}, "
-                    f"Squat: {self.squat_count[track_id]}, Pushup: {self.pushup_count[track_id]}"
-                )
-
-        # Final image output with annotations
-        plot_im = annotator.result()
+                if annotator is not None:
+                    self.draw_overlay(
+                        annotator, tracks.keypoints.data[i], kpts_indices, angle, track_id, exercise
+                    )
+
+                # Debug log of exercise and counts per person; %-style formatting is only
+                # evaluated when DEBUG is actually enabled, so the hot path stays free of I/O
+                if self.verbose and logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "[ID %d] Esercizio: %s, Squat: %d, Pushup: %d",
+                        track_id, exercise, self.state["squat"][track_id], self.state["pushup"][track_id],
+                    )
+
+        # Final image output with annotations (raw frame when drawing is disabled)
+        plot_im = annotator.result() if annotator is not None else im0
         self.display_output(plot_im)
 
-        # Return results including frame and counts
+        # Return results including frame and counts (serialized to plain lists only here)
         return SolutionResults(
             plot_im=plot_im,
-            workout_count={"squat": self.squat_count, "pushup": self.pushup_count},
-            workout_stage=self.stage,
-            workout_angle=self.angle,
+            workout_count={"squat": self.state["squat"].tolist(), "pushup": self.state["pushup"].tolist()},
+            workout_stage=[_STAGE_NAMES[s] for s in self.state["stage"].tolist()],
+            workout_angle=self.state["angle"].tolist(),
             total_tracks=len(self.track_ids),
         )